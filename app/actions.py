@@ -1,7 +1,8 @@
 # app/actions.py
 
+import string
 from enum import Enum
-from typing import TypedDict, Dict
+from typing import Callable, Dict, NamedTuple
 
 class ActionName(str, Enum):
     CHECK_HOME_LOANS = "check_home_loans"
@@ -12,32 +13,87 @@ class ActionName(str, Enum):
 # Define the parameters expected per action:
 # We’ll use Pydantic models for validation (next section).
 
-# Prompt templates: use Python format strings.
-PROMPT_TEMPLATES: Dict[ActionName, str] = {
-    ActionName.CHECK_HOME_LOANS: """
-You are a browser automation generator. Output ONLY a JSON array of actions in the DSL:
-  - navigate, click, type, wait, extract.
-Your goal: find home loan eligibility requirements for a borrower with:
-  - annual_income: {annual_income}
-  - credit_score: {credit_score}
+class PromptTemplate(NamedTuple):
+    """
+    A prompt split into a byte-for-byte static system prefix and a small
+    dynamic user template. Keeping every dynamic value in the tail lets
+    Ollama reuse its KV cache for the identical system prefix across all
+    invocations of the same action.
+    """
+    system: str
+    user: str
+
+# Prompt templates: static instructions in `system`, Python format strings
+# carrying only the per-request values in `user`.
+PROMPT_TEMPLATES: Dict[ActionName, PromptTemplate] = {
+    ActionName.CHECK_HOME_LOANS: PromptTemplate(
+        system="""
+You are a browser automation generator. Output ONLY a JSON object with two keys:
+  - "actions": a JSON array of actions in the DSL (navigate, click, type, wait, extract).
+  - "summary_template": one sentence summarizing the outcome, using the literal placeholder {results} where the extracted data should appear.
+Your goal: find home loan eligibility requirements for the borrower described in the USER block.
 On a known, whitelisted site (e.g., examplebank.com). Only navigate to examplebank.com URLs.
 Generate actions to navigate the site’s home loan page, extract key eligibility criteria (e.g., min income, max loan amount).
-Return a JSON array only.
+Return the JSON object only.
 """.strip(),
-    ActionName.CHECK_MSME_LOANS: """
-You are a browser automation generator. Output ONLY a JSON array of actions in the DSL.
-Goal: find MSME loan schemes for a business with:
+        user="""
+USER:
+  - annual_income: {annual_income}
+  - credit_score: {credit_score}
+""".strip(),
+    ),
+    ActionName.CHECK_MSME_LOANS: PromptTemplate(
+        system="""
+You are a browser automation generator. Output ONLY a JSON object with two keys:
+  - "actions": a JSON array of actions in the DSL.
+  - "summary_template": one sentence summarizing the outcome, using the literal placeholder {results} where the extracted data should appear.
+Goal: find MSME loan schemes for the business described in the USER block.
+Search on examplebank.com’s MSME section. Only navigate within examplebank.com domain.
+Return the JSON object only.
+""".strip(),
+        user="""
+USER:
   - annual_revenue: {annual_revenue}
   - industry: "{industry}"
-Search on examplebank.com’s MSME section. Only navigate within examplebank.com domain.
-Return JSON array only.
 """.strip(),
-    ActionName.EXTRACT_RATE_BANK: """
-You are a browser automation generator. Output ONLY a JSON array of actions in the DSL.
-Goal: extract the current interest rate for {loan_type} from {bank_domain}. 
-Only navigate to URLs under {bank_domain}. 
-Generate actions to go to the homepage of {bank_domain}, click “Loans” → "{loan_type}" section, extract the main interest rate element.
-Return JSON array only.
+    ),
+    ActionName.EXTRACT_RATE_BANK: PromptTemplate(
+        system="""
+You are a browser automation generator. Output ONLY a JSON object with two keys:
+  - "actions": a JSON array of actions in the DSL.
+  - "summary_template": one sentence summarizing the outcome, using the literal placeholder {results} where the extracted data should appear.
+Goal: extract the current interest rate for the loan type and bank domain described in the USER block.
+Only navigate to URLs under that bank domain.
+Generate actions to go to the bank homepage, click “Loans” → the loan type section, extract the main interest rate element.
+Return the JSON object only.
+""".strip(),
+        user="""
+USER:
+  - loan_type: {loan_type}
+  - bank_domain: {bank_domain}
 """.strip(),
+    ),
     # ...more templates
 }
+
+def _compile(template: str) -> Callable[[dict], str]:
+    """
+    Parse a format string once into (literal, field_name) chunks and return a
+    closure that renders it by joining literals with parameter lookups,
+    avoiding str.format's per-call template re-parse.
+    """
+    parts = [
+        (literal, field_name)
+        for literal, field_name, _spec, _conv in string.Formatter().parse(template)
+    ]
+    def render(params: dict) -> str:
+        return "".join(
+            literal + (str(params[field]) if field else "")
+            for literal, field in parts
+        )
+    return render
+
+# User-template renderers, compiled once at import time.
+COMPILED_TEMPLATES: Dict[ActionName, Callable[[dict], str]] = {
+    name: _compile(template.user) for name, template in PROMPT_TEMPLATES.items()
+}
@@ -1,152 +1,250 @@
 # app/browseruse_agent.py
 
-import json
+import asyncio
 import logging
-import playwright.sync_api
-from typing import List, Literal, Optional, Union
+from typing import FrozenSet, List, Optional, Union
 from urllib.parse import urlparse
 
-from pydantic import BaseModel, HttpUrl, ValidationError
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import httpx
+import msgspec
+from playwright.async_api import async_playwright, Browser, Page, TimeoutError as PlaywrightTimeoutError
 
-from app.ollama_client import query_ollama
+from app.ollama_client import query_ollama_stream
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # === DSL Models for Browser Actions ===
+# msgspec tagged-union structs: the "action" field is the tag, so decoding a
+# JSON array dispatches to the right struct in C instead of a Python
+# if/elif chain, and skips Pydantic model construction entirely.
 
-class NavigateAction(BaseModel):
-    action: Literal["navigate"]
-    url: HttpUrl
+class NavigateAction(msgspec.Struct, tag="navigate", tag_field="action"):
+    url: str
 
-class ClickAction(BaseModel):
-    action: Literal["click"]
+    def __post_init__(self):
+        # Keep the HttpUrl invariant from the Pydantic era: only absolute
+        # http(s) URLs with a host are navigable; javascript:/file: and
+        # malformed strings are rejected at decode time.
+        parts = urlparse(self.url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError(f"Invalid navigate URL: {self.url!r}")
+
+class ClickAction(msgspec.Struct, tag="click", tag_field="action"):
     selector: str
     wait_for: Optional[str] = None  # CSS selector to wait for after click
 
-class TypeAction(BaseModel):
-    action: Literal["type"]
+class TypeAction(msgspec.Struct, tag="type", tag_field="action"):
     selector: str
     text: str
     clear: Optional[bool] = True
     delay: Optional[int] = None  # milliseconds between keystrokes
 
-class WaitAction(BaseModel):
-    action: Literal["wait"]
+class WaitAction(msgspec.Struct, tag="wait", tag_field="action"):
     selector: Optional[str] = None  # if None, just sleep timeout
     timeout: Optional[int] = 5000  # ms
 
-class ExtractAction(BaseModel):
-    action: Literal["extract"]
+class ExtractAction(msgspec.Struct, tag="extract", tag_field="action"):
     selector: str
     attribute: Optional[str] = None  # if None, extract inner_text
 
 # Union type for convenience
 BrowserAction = Union[NavigateAction, ClickAction, TypeAction, WaitAction, ExtractAction]
 
+_ACTION_DECODER = msgspec.json.Decoder(List[BrowserAction])
+
+class ActionPlan(msgspec.Struct):
+    """
+    One-shot SLM response: the action DSL plus an optional summary template
+    with a {results} placeholder, so no second summarization roundtrip is
+    needed after execution.
+    """
+    actions: List[BrowserAction]
+    summary_template: Optional[str] = None
+
+_PLAN_DECODER = msgspec.json.Decoder(Union[ActionPlan, List[BrowserAction]])
+
+def decode_plan(raw: str) -> ActionPlan:
+    """
+    Decode a raw SLM response into an ActionPlan. A bare JSON array (older
+    prompt style, or a model ignoring the object instruction) is accepted
+    and wrapped with no summary template.
+    Raises msgspec.DecodeError on malformed JSON or schema mismatch.
+    """
+    decoded = _PLAN_DECODER.decode(raw.encode())
+    if isinstance(decoded, ActionPlan):
+        return decoded
+    return ActionPlan(actions=decoded)
+
+REPAIR_SYSTEM_PROMPT = (
+    "The response you are given was not valid JSON or did not match the expected DSL schema. "
+    "Please output ONLY the corrected JSON array of actions, nothing else."
+)
+
+def decode_actions(raw: str) -> List[BrowserAction]:
+    """
+    Decode a raw SLM response into validated DSL actions in one shot.
+    Raises msgspec.DecodeError on malformed JSON or schema mismatch
+    (unknown action tag, missing/mistyped fields).
+    """
+    return _ACTION_DECODER.decode(raw.encode())
+
 
 # === Function to Execute Actions via Playwright ===
 
 # === Function to Generate Browser Actions via SLM ===
 
-def generate_browser_actions(prompt: str, max_attempts: int = 2) -> List[BrowserAction]:
+async def _stream_decode_attempt(prompt: str, system: str = None):
+    """
+    Stream one generation, attempting a decode each time the buffer ends at a
+    plausible array boundary. A successful early decode abandons the rest of
+    the stream, so trailing tokens (prose after the closing bracket, stray
+    whitespace) cost nothing. Returns (actions, raw); actions is None when
+    even the complete output failed to decode, and raw is None when the
+    stream itself failed (transport error, nothing worth repairing).
+    """
+    parts: List[str] = []
+    gen = query_ollama_stream(prompt, system=system)
+    try:
+        async for chunk in gen:
+            parts.append(chunk)
+            candidate = "".join(parts).strip()
+            if candidate.endswith("]"):
+                try:
+                    return decode_actions(candidate), candidate
+                except msgspec.DecodeError:
+                    pass
+    except httpx.HTTPError as e:
+        logger.warning(f"Ollama stream failed: {e}")
+        return None, None
+    finally:
+        await gen.aclose()
+    raw = "".join(parts).strip()
+    try:
+        return decode_actions(raw), raw
+    except msgspec.DecodeError:
+        return None, raw
+
+async def generate_browser_actions(prompt: str, max_attempts: int = 2) -> List[BrowserAction]:
     """
     Given a prompt instructing the SLM to output a JSON array of browser actions
-    following the DSL, call the local Ollama SLM, parse and validate the JSON.
-    If parsing fails, will attempt to repair by re-prompting once.
-    Raises RuntimeError on persistent failure.
-    """
-    raw = query_ollama(prompt)
-    logger.info(f"Raw SLM output: {raw}")
-    last_raw = raw
-    for attempt in range(max_attempts):
-        try:
-            arr = json.loads(raw)
-            if not isinstance(arr, list):
-                raise ValueError("SLM output JSON is not a list")
-            validated_actions: List[BrowserAction] = []
-            for obj in arr:
-                if not isinstance(obj, dict):
-                    raise ValueError(f"Action is not an object: {obj}")
-                action_type = obj.get("action")
-                if action_type == "navigate":
-                    act = NavigateAction(**obj)
-                elif action_type == "click":
-                    act = ClickAction(**obj)
-                elif action_type == "type":
-                    act = TypeAction(**obj)
-                elif action_type == "wait":
-                    act = WaitAction(**obj)
-                elif action_type == "extract":
-                    act = ExtractAction(**obj)
-                else:
-                    raise ValueError(f"Unknown action type: {action_type}")
-                validated_actions.append(act)
-            logger.info(f"Validated actions: {validated_actions}")
-            return validated_actions
-        except (json.JSONDecodeError, ValueError, ValidationError) as e:
-            logger.warning(f"Failed to parse/validate actions (attempt {attempt+1}): {e}")
-            if attempt + 1 < max_attempts:
-                # Ask SLM to correct the output strictly as JSON array
-                repair_prompt = (
-                    "The previous response was not valid JSON or did not match the expected DSL schema. "
-                    "Please output ONLY the corrected JSON array of actions, nothing else. "
-                    "Here was the previous response:\n"
-                    + last_raw
-                )
-                raw = query_ollama(repair_prompt)
-                last_raw = raw
-                logger.info(f"Repair attempt raw output: {raw}")
-            else:
-                break
+    following the DSL, stream the generation from the local Ollama SLM and
+    validate incrementally: the actions are returned as soon as the streamed
+    buffer decodes, without waiting for the generation to finish. If the full
+    output never parses, re-prompts for a repair up to max_attempts total
+    attempts. Raises RuntimeError on persistent failure.
+    """
+    actions, last_raw = await _stream_decode_attempt(prompt)
+    if actions is not None:
+        logger.info(f"Validated actions: {actions}")
+        return actions
+    for attempt in range(1, max_attempts):
+        if last_raw is None:
+            # Transport failure, not a parse failure: there is no output to
+            # repair, so retry the original prompt instead.
+            logger.warning(f"Stream failed (attempt {attempt}); retrying original prompt")
+            actions, last_raw = await _stream_decode_attempt(prompt)
+        else:
+            logger.warning(f"Failed to parse/validate actions (attempt {attempt}); requesting repair")
+            # Ask SLM to correct the output strictly as JSON array; the
+            # static instruction goes in the system prefix.
+            actions, last_raw = await _stream_decode_attempt(last_raw, system=REPAIR_SYSTEM_PROMPT)
+        if actions is not None:
+            logger.info(f"Validated actions after repair: {actions}")
+            return actions
     raise RuntimeError(f"Failed to generate valid browser actions after {max_attempts} attempts. Last output: {last_raw}")
 
 
-# === Optional Helper: Domain Whitelist Validation ===
+# === Persistent Browser Singleton ===
+# Launching chromium costs ~500ms; keep one browser per process and hand out
+# fresh pages per action group instead.
 
-# app/browseruse_agent.py (patched excerpts)
+_PLAYWRIGHT = None
+_BROWSER: Optional[Browser] = None
+_BROWSER_LOCK = asyncio.Lock()
 
-from urllib.parse import urlparse
+async def get_browser(headless: bool = True) -> Browser:
+    """Launch (once) and return the shared chromium instance."""
+    global _PLAYWRIGHT, _BROWSER
+    async with _BROWSER_LOCK:
+        if _BROWSER is None or not _BROWSER.is_connected():
+            _PLAYWRIGHT = await async_playwright().start()
+            _BROWSER = await _PLAYWRIGHT.chromium.launch(headless=headless)
+    return _BROWSER
+
+async def close_browser() -> None:
+    """Tear down the shared browser (e.g. at application shutdown)."""
+    global _PLAYWRIGHT, _BROWSER
+    async with _BROWSER_LOCK:
+        if _BROWSER is not None:
+            await _BROWSER.close()
+            _BROWSER = None
+        if _PLAYWRIGHT is not None:
+            await _PLAYWRIGHT.stop()
+            _PLAYWRIGHT = None
 
-def run_browser_actions(
+
+# === Function to Execute Actions via Playwright ===
+
+def _split_groups(actions: List[BrowserAction]) -> List[List[BrowserAction]]:
+    """
+    Partition actions into independent groups: each navigate starts a new
+    group and the same-page actions that follow it belong to that group.
+    Groups carry no shared page state, so they can run concurrently.
+    """
+    groups: List[List[BrowserAction]] = []
+    current: List[BrowserAction] = []
+    for act in actions:
+        if isinstance(act, NavigateAction) and current:
+            groups.append(current)
+            current = []
+        current.append(act)
+    if current:
+        groups.append(current)
+    return groups
+
+async def _run_group(
+    browser: Browser,
     actions: List[BrowserAction],
-    headless: bool = True,
-    timeout_ms: int = 30000
+    timeout_ms: int
 ) -> List[dict]:
     results: List[dict] = []
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=headless)
-        page = browser.new_page()
-        page.set_default_timeout(timeout_ms)
+    page: Page = await browser.new_page()
+    page.set_default_timeout(timeout_ms)
+    try:
         for act in actions:
-            typ = act.action
             try:
-                if typ == "navigate":
-                    url = str(act.url)
-                    page.goto(url)
-                elif typ == "click":
-                    page.click(act.selector)
+                if isinstance(act, NavigateAction):
+                    await page.goto(act.url)
+                elif isinstance(act, ClickAction):
+                    await page.click(act.selector)
                     if act.wait_for:
-                        page.wait_for_selector(act.wait_for, timeout=timeout_ms)
-                elif typ == "type":
+                        await page.wait_for_selector(act.wait_for, timeout=timeout_ms)
+                elif isinstance(act, TypeAction):
                     if act.clear:
                         try:
-                            page.fill(act.selector, "")
+                            await page.fill(act.selector, "")
                         except PlaywrightTimeoutError:
                             pass
                     if act.delay is not None:
-                        page.type(act.selector, act.text, delay=act.delay)
+                        await page.type(act.selector, act.text, delay=act.delay)
                     else:
-                        page.fill(act.selector, act.text)
-                elif typ == "wait":
+                        await page.fill(act.selector, act.text)
+                elif isinstance(act, WaitAction):
                     if act.selector:
-                        page.wait_for_selector(act.selector, timeout=act.timeout or timeout_ms)
+                        await page.wait_for_selector(act.selector, timeout=act.timeout or timeout_ms)
                     else:
-                        page.wait_for_timeout(act.timeout or 1000)
-                elif typ == "extract":
+                        await page.wait_for_timeout(act.timeout or 1000)
+                elif isinstance(act, ExtractAction):
+                    # One protocol roundtrip: resolve the selector and read
+                    # the value in a single page evaluation, instead of a
+                    # locator() resolution followed by a second fetch.
+                    val = await page.eval_on_selector(
+                        act.selector,
+                        "(el, attr) => attr ? el.getAttribute(attr) : el.innerText",
+                        act.attribute,
+                    )
                     if act.attribute:
-                        val = page.locator(act.selector).get_attribute(act.attribute)
                         results.append({
                             "action": "extract",
                             "selector": act.selector,
@@ -154,27 +252,48 @@ def run_browser_actions(
                             "value": val,
                         })
                     else:
-                        text = page.locator(act.selector).inner_text()
                         results.append({
                             "action": "extract",
                             "selector": act.selector,
-                            "text": text,
+                            "text": val,
                         })
             except PlaywrightTimeoutError as e:
-                info = act.model_dump() if hasattr(act, "model_dump") else act.dict()
+                info = msgspec.to_builtins(act)
                 results.append({"error": f"Timeout on action {info}: {e}"})
             except Exception as e:
-                info = act.model_dump() if hasattr(act, "model_dump") else act.dict()
+                info = msgspec.to_builtins(act)
                 results.append({"error": f"Error on action {info}: {e}"})
-        browser.close()
+    finally:
+        await page.close()
     return results
 
-def validate_navigate_domains(actions: List[BrowserAction], allowed_domains: List[str]) -> None:
+async def run_browser_actions(
+    actions: List[BrowserAction],
+    headless: bool = True,
+    timeout_ms: int = 30000
+) -> List[dict]:
+    """
+    Execute actions on the shared browser. Independent navigate-delimited
+    groups run concurrently, each on its own page; results are returned in
+    the original action order.
+    """
+    browser = await get_browser(headless=headless)
+    groups = _split_groups(actions)
+    group_results = await asyncio.gather(
+        *(_run_group(browser, group, timeout_ms) for group in groups)
+    )
+    return [result for group in group_results for result in group]
+
+def validate_navigate_domains(actions: List[BrowserAction], allowed_domains: FrozenSet[str]) -> None:
+    """
+    Check each navigate target against the whitelist. Pass a frozenset (e.g.
+    schemas.ALLOWED_DOMAINS) so membership is O(1) instead of a list scan.
+    """
     for act in actions:
         if isinstance(act, NavigateAction):
-            domain = urlparse(str(act.url)).netloc
+            domain = urlparse(act.url).netloc
             if domain not in allowed_domains:
-                raise ValueError(f"Navigate domain '{domain}' not in allowed domains {allowed_domains}")
+                raise ValueError(f"Navigate domain '{domain}' not in allowed domains {sorted(allowed_domains)}")
 
 
 # === Example Usage ===
@@ -187,8 +306,8 @@ def validate_navigate_domains(actions: List[BrowserAction], allowed_domains: Lis
 # try:
 #     actions = generate_browser_actions(prompt)
 #     # Optionally validate domains:
-#     allowed = ["examplebank.com"]
-#     validate_navigate_domains(actions, allowed)
+#     from app.schemas import ALLOWED_DOMAINS
+#     validate_navigate_domains(actions, ALLOWED_DOMAINS)
 #     results = run_browser_actions(actions)
 #     # Summarize if needed via query_ollama
 # except Exception as e:
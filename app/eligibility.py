@@ -0,0 +1,33 @@
+# app/eligibility.py
+
+from typing import Dict
+
+# Static eligibility floors per bank; extend as more banks are onboarded.
+# Borrowers whose numeric parameters trivially fail these rules never need
+# an SLM call or a browser run — the endpoint short-circuits immediately.
+RULES: Dict[str, Dict[str, float]] = {
+    "examplebank.com": {
+        "min_income": 300000.0,   # INR, home loans
+        "min_score": 650,
+        "min_revenue": 1000000.0,  # INR, MSME loans
+    },
+    # ...
+}
+
+# The checks below are scalar comparisons, so plain Python is already the
+# fast path; if this grows into batched screening across many banks at once,
+# the arithmetic is a natural candidate for numba.njit over arrays.
+
+def eligible_home_loan(annual_income: float, credit_score: int, bank_domain: str = "examplebank.com") -> bool:
+    """True if the borrower clears the bank's home-loan floors (or the bank has no rules on file)."""
+    rules = RULES.get(bank_domain)
+    if rules is None:
+        return True  # unknown bank: let the SLM flow decide
+    return annual_income >= rules["min_income"] and credit_score >= rules["min_score"]
+
+def eligible_msme_loan(annual_revenue: float, bank_domain: str = "examplebank.com") -> bool:
+    """True if the business clears the bank's MSME revenue floor (or the bank has no rules on file)."""
+    rules = RULES.get(bank_domain)
+    if rules is None:
+        return True
+    return annual_revenue >= rules["min_revenue"]
@@ -1,103 +1,212 @@
 # app/main.py
 
-from fastapi import FastAPI, HTTPException, Path
-from pydantic import BaseModel
-from app.actions import ActionName, PROMPT_TEMPLATES
+import re
+
+from fastapi import FastAPI, HTTPException, Request
+from app.actions import ActionName, PROMPT_TEMPLATES, COMPILED_TEMPLATES
 from app.schemas import ACTION_PARAM_MODELS
-from app.ollama_client import query_ollama
-from app.browseruse_agent import run_browser_actions
-import json
+from app.eligibility import eligible_home_loan, eligible_msme_loan
+from app.ollama_client import query_ollama, query_ollama_stream
+from app.browseruse_agent import run_browser_actions, decode_plan, NavigateAction, get_browser, close_browser
+import msgspec
+import orjson
 
 app = FastAPI(title="Sampatti Lighthouse API")
 
-class ActionRequest(BaseModel):
-    # This model is dynamic: we’ll validate per-action in the endpoint.
-    pass
+# GenCache-style caches for the SLM-generated action DSL.
+# ACTION_CACHE stores the raw JSON for an exact (action, params) pair.
+# SKELETON_CACHE stores one parameter-agnostic template per action, built by
+# substituting the literal param values back into {placeholders}; a new params
+# combination is then served by str.format with zero SLM roundtrip.
+ACTION_CACHE: dict = {}
+SKELETON_CACHE: dict = {}
 
-@app.post("/action/{action_name}")
-async def do_action(
-    action_name: ActionName = Path(..., description="One of the predefined actions"),
-    params: dict = None
-):
+@app.on_event("startup")
+async def _warm():
     """
-    Execute a predefined browseruse action via local SLM + Playwright.
+    Pay cold-start costs before the first user request: launch the shared
+    chromium instance and ping Ollama so the model is resident in memory.
     """
-    # 1. Validate params via the corresponding Pydantic model
-    ParamModel = ACTION_PARAM_MODELS.get(action_name)
-    if ParamModel is None:
-        raise HTTPException(status_code=400, detail="No parameters model for this action")
     try:
-        # Pydantic validation
-        parsed = ParamModel(**(params or {}))
-    except Exception as e:
-        raise HTTPException(status_code=422, detail=str(e))
+        await get_browser()
+    except Exception:
+        # Playwright may be unavailable in some deployments; the first
+        # browser request will surface the real error.
+        pass
+    try:
+        # Stream directly (bypassing the response cache) and stop at the
+        # first token: that proves the model is loaded.
+        async for _ in query_ollama_stream("hi"):
+            break
+    except Exception:
+        pass
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await close_browser()
+
+# Param values shorter than this are never substituted into a skeleton: a
+# 3-digit credit score matches inside timeouts, selectors and URLs far too
+# easily. A skeleton that did not template cleanly is rejected outright — a
+# param value left behind as a literal would be served to every other param
+# combination as if it were theirs.
+_MIN_SKELETON_SUB_LEN = 4
+
+def _token_pattern(text: str) -> str:
+    return r"(?<![\w.])" + re.escape(text) + r"(?![\w.])"
+
+def _build_skeleton(raw_output: str, params: dict) -> str | None:
+    """
+    Turn a concrete SLM output into a format-string skeleton by replacing each
+    parameter value with its {param_name} placeholder. Longer values are
+    substituted first so one value embedded in another doesn't clobber it;
+    substitution requires token boundaries and a minimum length so a short
+    numeric value can't rewrite an unrelated number that merely contains it.
+    Returns None unless every substitutable param became a placeholder and no
+    short (unsubstituted) value survives as a literal token — the SLM may
+    have rendered a param differently (e.g. "home loan" as "home-loan"), and
+    such output cannot be safely reused for other params.
+    """
+    skeleton = raw_output.replace("{", "{{").replace("}", "}}")
+    for name, value in sorted(params.items(), key=lambda kv: len(str(kv[1])), reverse=True):
+        text = str(value)
+        if len(text) < _MIN_SKELETON_SUB_LEN:
+            continue
+        skeleton = re.sub(_token_pattern(text), "{%s}" % name, skeleton)
+    for name, value in params.items():
+        text = str(value)
+        if len(text) >= _MIN_SKELETON_SUB_LEN:
+            if ("{%s}" % name) not in skeleton:
+                return None
+        elif text and re.search(_token_pattern(text), skeleton):
+            return None
+    return skeleton
+
+async def _do_action(action_name: ActionName, parsed) -> dict:
+    """
+    Execute a predefined browseruse action via local SLM + Playwright.
+    `parsed` is the already-validated param Struct for the action.
+    """
+    # 1. Numeric pre-filter: a borrower who trivially fails the static
+    # eligibility rules skips the SLM and browser roundtrips entirely.
+    if action_name == ActionName.CHECK_HOME_LOANS:
+        if not eligible_home_loan(parsed.annual_income, parsed.credit_score):
+            return {"eligible": False, "reason": "Below minimum income or credit score for home loans"}
+    elif action_name == ActionName.CHECK_MSME_LOANS:
+        if not eligible_msme_loan(parsed.annual_revenue):
+            return {"eligible": False, "reason": "Below minimum annual revenue for MSME loans"}
 
     # 2. Build prompt
     template = PROMPT_TEMPLATES.get(action_name)
     if template is None:
         raise HTTPException(status_code=500, detail="No prompt template configured")
-    prompt = template.format(**parsed.dict())
+    param_dict = msgspec.structs.asdict(parsed)
+    cache_key = (action_name, frozenset(param_dict.items()))
+
+    # 3. Serve from cache if possible: exact (action, params) hit first, then
+    # the per-action skeleton re-substituted with the current params. Either
+    # way a hit means zero SLM roundtrip.
+    plan = None
+    raw_output = ACTION_CACHE.get(cache_key)
+    if raw_output is None:
+        skeleton = SKELETON_CACHE.get(action_name)
+        if skeleton is not None:
+            try:
+                raw_output = skeleton.format(**param_dict)
+            except Exception:
+                # Unknown field, unbalanced braces from a param value, etc.:
+                # evict here so a poisoned skeleton can't wedge the action.
+                SKELETON_CACHE.pop(action_name, None)
+                raw_output = None
+    if raw_output is not None:
+        try:
+            plan = decode_plan(raw_output)
+        except msgspec.DecodeError:
+            # Stale or badly templated cache entry; fall through to the SLM.
+            ACTION_CACHE.pop(cache_key, None)
+            SKELETON_CACHE.pop(action_name, None)
+            plan = None
 
-    # 3. Query local Ollama SLM
+    # 4. Query local Ollama SLM on miss. One call yields both the action DSL
+    # and a summary template, so there is no second summarization roundtrip.
     # Optionally set temperature=0 or low to reduce randomness
-    raw_output = query_ollama(prompt)
-    # 4. Parse JSON
-    try:
-        actions_list = json.loads(raw_output)
-    except json.JSONDecodeError as e:
-        # If malformed, optionally try a repair prompt or return error
-        raise HTTPException(status_code=500, detail=f"SLM output not valid JSON: {e}: {raw_output}")
-
-    # 5. Validate each action via Pydantic DSL models
-    from app.browseruse_agent import (
-        NavigateAction, ClickAction, TypeAction, WaitAction, ExtractAction
-    )
-    validated_actions = []
-    for obj in actions_list:
-        action_type = obj.get("action")
+    if plan is None:
+        prompt = COMPILED_TEMPLATES[action_name](param_dict)
+        raw_output = await query_ollama(prompt, system=template.system)
         try:
-            if action_type == "navigate":
-                act = NavigateAction(**obj)
-                # Additional: validate domain again
-                from urllib.parse import urlparse
-                domain = urlparse(act.url).netloc
-                # Ensure domain matches the whitelisted domain(s) from params if applicable
-                # E.g., for EXTRACT_RATE_BANK, ensure domain == parsed.bank_domain
-                if action_name == ActionName.EXTRACT_RATE_BANK:
-                    if domain != parsed.bank_domain:
-                        raise ValueError(f"Navigate domain {domain} not allowed for this action")
-            elif action_type == "click":
-                act = ClickAction(**obj)
-            elif action_type == "type":
-                act = TypeAction(**obj)
-            elif action_type == "wait":
-                act = WaitAction(**obj)
-            elif action_type == "extract":
-                act = ExtractAction(**obj)
-            else:
-                raise ValueError(f"Unknown action type: {action_type}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Action validation error: {e}")
-        validated_actions.append(act)
+            plan = decode_plan(raw_output)
+        except msgspec.DecodeError as e:
+            # If malformed, optionally try a repair prompt or return error
+            raise HTTPException(status_code=500, detail=f"SLM output not valid action DSL: {e}: {raw_output}")
+        ACTION_CACHE[cache_key] = raw_output
+        skeleton = _build_skeleton(raw_output, param_dict)
+        if skeleton is not None:
+            SKELETON_CACHE[action_name] = skeleton
+    validated_actions = plan.actions
+
+    # 5. Re-validate navigate domains against the whitelisted domain(s) from
+    # params if applicable, e.g. for EXTRACT_RATE_BANK ensure the SLM only
+    # navigates to parsed.bank_domain.
+    from urllib.parse import urlparse
+    for act in validated_actions:
+        if isinstance(act, NavigateAction) and action_name == ActionName.EXTRACT_RATE_BANK:
+            domain = urlparse(act.url).netloc
+            if domain != parsed.bank_domain:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Action validation error: Navigate domain {domain} not allowed for this action",
+                )
 
     # 6. Execute via Playwright
     try:
-        results = run_browser_actions(validated_actions)
+        results = await run_browser_actions(validated_actions)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Browser execution error: {e}")
 
-    # 7. Summarize if desired
+    # 7. Summarize: format the template from the plan with the results, and
+    # only fall back to a second SLM call when the plan carried no template.
     summary = None
-    try:
-        summary_prompt = (
-            "Summarize the following extracted data in concise terms:\n"
-            + json.dumps(results, indent=2)
-        )
-        summary = query_ollama(summary_prompt)
-    except Exception:
-        summary = "Failed to summarize results."
+    if plan.summary_template:
+        try:
+            summary = plan.summary_template.format(results=orjson.dumps(results).decode())
+        except (KeyError, IndexError, ValueError):
+            # SLM-emitted templates can carry stray braces or unknown fields;
+            # fall back to the summarization call below.
+            summary = None
+    if summary is None:
+        try:
+            summary = await query_ollama(
+                orjson.dumps(results, option=orjson.OPT_INDENT_2).decode(),
+                system="Summarize the following extracted data in concise terms.",
+            )
+        except Exception:
+            summary = "Failed to summarize results."
+
+    return {"actions": [msgspec.to_builtins(a) for a in validated_actions], "results": results, "summary": summary}
 
-    return {"actions": [a.dict() for a in validated_actions], "results": results, "summary": summary}
+# One concrete route per action, registered at import time. Each handler
+# decodes the request body straight into its param Struct with msgspec —
+# a single typed parse instead of an untyped dict body followed by a second
+# validation pass.
+def _make_handler(action_name: ActionName, model):
+    async def handler(request: Request):
+        body = await request.body()
+        try:
+            parsed = msgspec.json.decode(body or b"{}", type=model)
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return await _do_action(action_name, parsed)
+    handler.__name__ = f"do_{action_name.value}"
+    return handler
+
+for _name, _model in ACTION_PARAM_MODELS.items():
+    app.add_api_route(
+        f"/action/{_name.value}",
+        _make_handler(_name, _model),
+        methods=["POST"],
+        name=f"do_{_name.value}",
+        summary=f"Execute the {_name.value} action via local SLM + Playwright",
+    )
 
 #Auto-Form Parsing Endpoint
 from fastapi import FastAPI, UploadFile, File, Form
@@ -1,19 +1,109 @@
-import requests
+import functools
+import hashlib
+
+import httpx
+import orjson
+import diskcache
+from cachetools import TTLCache
 
 OLLAMA_HOST = "http://localhost:11434"
 DEFAULT_MODEL = "phi3:mini"
 
-def query_ollama(prompt: str, model: str = DEFAULT_MODEL) -> str:
+# Two-tier response cache: an in-process TTL/LRU tier in front of a disk tier
+# that survives restarts. Keyed by a digest of (model, prompt), so a repeated
+# byte-identical prompt (e.g. the same CHECK_HOME_LOANS params) skips the
+# multi-second generation entirely.
+_MEM_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_DISK_CACHE = diskcache.Cache("/tmp/ollama_cache")
+_CACHE_TTL_SECONDS = 3600
+
+_TIMEOUT = httpx.Timeout(120.0, connect=3.0)
+
+# One shared client per process: keep-alive connections to localhost:11434
+# are pooled and reused instead of a fresh TCP handshake per query, which
+# matters under FastAPI concurrency and repair-loop retries. Transport-level
+# retries absorb transient connect errors so the repair loop in
+# generate_browser_actions doesn't treat them as parse failures.
+_CLIENT = httpx.AsyncClient(
+    timeout=_TIMEOUT,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+    transport=httpx.AsyncHTTPTransport(retries=2),
+)
+
+
+def _cache_key(model: str, prompt: str, system: str = None) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model.encode())
+    h.update(b"\x00")
+    h.update(prompt.encode())
+    if system:
+        h.update(b"\x00")
+        h.update(system.encode())
+    return h.hexdigest()
+
+
+def cached_query(func):
+    """
+    Decorator adding the two-tier exact-match cache around an Ollama query
+    coroutine. Error responses are returned but never cached.
+    """
+    @functools.wraps(func)
+    async def wrapper(prompt: str, model: str = DEFAULT_MODEL, system: str = None) -> str:
+        key = _cache_key(model, prompt, system)
+        hit = _MEM_CACHE.get(key)
+        if hit is not None:
+            return hit
+        hit = _DISK_CACHE.get(key)
+        if hit is not None:
+            _MEM_CACHE[key] = hit
+            return hit
+        result = await func(prompt, model, system)
+        if not result.startswith("Ollama API error:"):
+            _MEM_CACHE[key] = result
+            _DISK_CACHE.set(key, result, expire=_CACHE_TTL_SECONDS)
+        return result
+    return wrapper
+
+
+async def query_ollama_stream(prompt: str, model: str = DEFAULT_MODEL, system: str = None):
+    """
+    Stream a generation from Ollama, yielding each chunk's "response" text as
+    it arrives. A static `system` prefix is sent via Ollama's dedicated field
+    so the server can reuse its KV cache across calls sharing that prefix.
+    Raises httpx.HTTPError on transport or status errors.
+    """
     url = f"{OLLAMA_HOST}/api/generate"
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False
+        "stream": True
     }
+    if system:
+        payload["system"] = system
+    async with _CLIENT.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+            text = chunk.get("response")
+            if text:
+                yield text
+            if chunk.get("done"):
+                break
+
 
+@cached_query
+async def query_ollama(prompt: str, model: str = DEFAULT_MODEL, system: str = None) -> str:
+    """
+    Run a full generation and return the stripped response text. Streams
+    under the hood so the first tokens are processed while the model is
+    still generating.
+    """
+    buf = bytearray()
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()["response"].strip()
-    except requests.exceptions.RequestException as e:
+        async for text in query_ollama_stream(prompt, model, system):
+            buf.extend(text.encode())
+    except httpx.HTTPError as e:
         return f"Ollama API error: {str(e)}"
+    return bytes(buf).decode().strip()
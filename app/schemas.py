@@ -1,30 +1,34 @@
 # app/schemas.py
 
-from pydantic import BaseModel, Field, HttpUrl, field_validator
+from typing import Annotated
+
+import msgspec
+from msgspec import Meta
+
 from app.actions import ActionName
 
-class BaseActionParams(BaseModel):
+# Whitelisted bank domains; you can load from config. Built once at import
+# so validation is a single frozenset membership test.
+ALLOWED_DOMAINS = frozenset({"examplebank.com", "anotherbank.in"})
+
+class BaseActionParams(msgspec.Struct):
     pass
 
 class CheckHomeLoansParams(BaseActionParams):
-    annual_income: float = Field(..., gt=0, description="Annual income in INR")
-    credit_score: int = Field(..., ge=300, le=900)
+    annual_income: Annotated[float, Meta(gt=0, description="Annual income in INR")]
+    credit_score: Annotated[int, Meta(ge=300, le=900)]
 
 class CheckMSMELoansParams(BaseActionParams):
-    annual_revenue: float = Field(..., gt=0, description="Annual revenue in INR")
-    industry: str = Field(..., min_length=2)
+    annual_revenue: Annotated[float, Meta(gt=0, description="Annual revenue in INR")]
+    industry: Annotated[str, Meta(min_length=2)]
 
 class ExtractRateBankParams(BaseActionParams):
-    loan_type: str = Field(..., description="E.g., 'home loan', 'car loan'")
-    bank_domain: str = Field(..., description="Domain without protocol, e.g. examplebank.com")
-
-    @field_validator("bank_domain")
-    def validate_whitelist(cls, v):
-        # Whitelist domains; you can load from config
-        allowed = {"examplebank.com", "anotherbank.in"}
-        if v not in allowed:
-            raise ValueError(f"Domain {v} not in allowed list")
-        return v
+    loan_type: Annotated[str, Meta(description="E.g., 'home loan', 'car loan'")]
+    bank_domain: Annotated[str, Meta(description="Domain without protocol, e.g. examplebank.com")]
+
+    def __post_init__(self):
+        if self.bank_domain not in ALLOWED_DOMAINS:
+            raise ValueError(f"Domain {self.bank_domain} not in allowed list")
 
 # Map action names to their param model classes
 ACTION_PARAM_MODELS = {